@@ -9,24 +9,151 @@ import argparse
 import requests
 import re
 import platform
+import stat
 import time
-from typing import List, Dict, Any, Optional, Tuple
+import signal
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+from taskgpt.prompt_cache import GeminiPromptCache
+from taskgpt.router import API_KEY_ENV, ModelRouter
+from taskgpt.terminal import run_interactive
+from taskgpt.materialize import write_files
 
 # Default to Gemini
 DEFAULT_API = "gemini"
 
 __version__ = "0.1.5"
 
+# Static prompt prefixes. These are sent ahead of the per-call message and must
+# stay byte-identical between calls for provider-side prompt caching to apply.
+PLAN_INSTRUCTIONS = """You are an AI agent that generates executable commands for a computer.
+Based on the task description, generate a sequence of commands to achieve the task.
+
+IMPORTANT GUIDELINES:
+1. For empty files use: 'touch filename'
+2. For files that need content, use this special format:
+   WRITE_FILE:filename:file_content_here
+   (This is a special command our system understands)
+3. For C programs:
+   - Always add 'fflush(stdout);' after printf statements without newlines
+   - Example: printf("Enter number: "); fflush(stdout);
+4. For C++ programs:
+   - Use 'std::cout << "Prompt: " << std::flush;' for immediate display
+5. Include proper compilation commands with appropriate flags
+
+For each step include:
+1. A description of what the command does
+2. The exact command to run
+
+Format your response as a JSON array of objects with 'description' and 'command' keys.
+Example:
+[
+    {"description": "Create a directory for the project", "command": "mkdir project"},
+    {"description": "Create a C file with proper output handling", "command": "WRITE_FILE:add.c:#include <stdio.h>\\n\\nint main() {\\n    int a, b;\\n    printf(\\"Enter first number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &a);\\n    printf(\\"Enter second number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &b);\\n    printf(\\"Sum: %d\\n\\", a+b);\\n    return 0;\\n}"},
+    {"description": "Compile the C program", "command": "gcc -o add add.c"},
+    {"description": "Run the program", "command": "./add"}
+]
+Return ONLY the JSON array and no other text.
+"""
+
+WINDOWS_HINT = "This is a Windows system using cmd.exe. Avoid using bash-specific syntax."
+UNIX_HINT = "This is a Unix-like system. Use standard bash commands."
+
+DIAGNOSIS_INSTRUCTIONS = """You are a helpful debugging assistant. A command has failed during execution.
+You will be given the command, the description of the step it belongs to and its error output.
+
+Please analyze the error and provide:
+1. A brief explanation of what went wrong
+2. A concrete solution to fix the issue
+3. The exact command(s) needed to resolve the problem
+
+Format your response as a JSON object with keys:
+- "explanation": Brief description of the error
+- "solution": How to fix it
+- "commands": Array of commands to execute to fix the issue
+
+Example:
+{
+    "explanation": "The C compiler is not finding the math library.",
+    "solution": "Need to explicitly link the math library with -lm flag",
+    "commands": ["gcc -o program program.c -lm"]
+}
+
+Return ONLY the JSON object and no other text.
+"""
+
+CANDIDATE_DIAGNOSIS_INSTRUCTIONS = """You are a helpful debugging assistant. A command has failed during execution.
+You will be given the command, the description of the step it belongs to, its error output
+and the number of alternative fixes wanted.
+
+Please analyze the error and propose that many alternative ways to fix it.
+The alternatives should take genuinely different approaches, so that if one
+of them does not work another one might.
+
+Format your response as a JSON array of objects, each with keys:
+- "explanation": Brief description of the error
+- "solution": How this alternative fixes it
+- "commands": Array of commands to execute to fix the issue
+
+Example:
+[
+    {
+        "explanation": "The C compiler is not finding the math library.",
+        "solution": "Explicitly link the math library with -lm flag",
+        "commands": ["gcc -o program program.c -lm"]
+    },
+    {
+        "explanation": "The C compiler is not finding the math library.",
+        "solution": "Compile with g++, which links libm by default",
+        "commands": ["g++ -o program program.c"]
+    }
+]
+
+Return ONLY the JSON array and no other text.
+"""
+
 class TaskAgent:
-    def __init__(self, api_type: str = DEFAULT_API):
+    def __init__(self, api_type: str = DEFAULT_API, interactive: bool = True,
+                 model_config: Optional[str] = None, base_url: Optional[str] = None,
+                 model: Optional[str] = None):
         self.api_type = api_type
+        # Headless agents (queue workers) never prompt: plans and fixes are
+        # auto-approved and success is judged from the step results
+        self.interactive = interactive
         self.api_key = None
         self.is_windows = platform.system() == "Windows"
         self.error_recovery_attempts = 0
         self.max_recovery_attempts = 3
+        # Number of alternative fixes to request per failure; values above 1
+        # verify the candidates in parallel in throwaway workspaces
+        self.recovery_candidates = 1
+        self.candidate_timeout = 120
+        self.max_plan_attempts = 3
+        self.command_timeout = None
+        # Seconds to wait on a model request; a stalled connection would
+        # otherwise block the agent (and a worker's lease) indefinitely
+        self.request_timeout = 120
+        # Bytes of interactive program output kept for error diagnosis
+        self.transcript_limit = 8192
+        self.fsync_writes = False
+        self.last_results = []
+        self.plan_instructions = f"{PLAN_INSTRUCTIONS}\n{WINDOWS_HINT if self.is_windows else UNIX_HINT}\n"
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        
+        # Picks the model for each plan/diagnosis/continuation call
+        self.router = ModelRouter(api_type, config_path=model_config, base_url=base_url, model=model)
         
         # Try to get API key, asking for it if not available
         self._get_or_prompt_api_key()
+        
+        # Explicit prefix caching; OpenAI caches prompt prefixes on its own
+        self.prompt_cache = None
+        if self.api_type == "gemini" and self.api_key and os.getenv("TASKGPT_PROMPT_CACHE", "on").lower() not in ("0", "off", "false"):
+            self.prompt_cache = GeminiPromptCache(self.api_key)
 
     def _get_or_prompt_api_key(self) -> None:
         """Get API key from environment or prompt user for it."""
@@ -40,6 +167,13 @@ class TaskAgent:
         # Check environment variable
         api_key = os.getenv(env_key)
         
+        # Routes that only use other endpoints (e.g. a local server) don't need the key
+        if not api_key and not self.router.uses_key(env_key):
+            return
+        
+        if not api_key and not self.interactive:
+            raise ValueError(f"{env_key} is not set.")
+        
         # If not found, prompt user
         if not api_key:
             print(f"{env_key} not found in environment variables.")
@@ -85,176 +219,193 @@ class TaskAgent:
             print(f"You can manually add it by setting the {env_key} environment variable.")
 
     def generate_plan(self, task_description: str, feedback: Optional[str] = None) -> List[Dict[str, str]]:
-        context = task_description
+        # Only the task varies between calls; it goes after the static instructions
+        # so the instructions form a cacheable prefix
+        message = f"Task: {task_description}"
+        call_type = "plan"
         if feedback:
-            context += f"\n\nPrevious attempt feedback: {feedback}"
-
-        # Add specific instructions for C/C++ prompt output handling
-        file_creation_hint = (
-            "For file creation: Use 'touch' only for empty files. "
-            "For files that need content, use 'WRITE_FILE:filename:content' as a special command. "
-            "For C/C++ programs, always include 'fflush(stdout);' after printf statements without newlines to ensure prompts are displayed. "
-            "For C++ programs, use 'std::cout << ... << std::flush;' to ensure output is displayed immediately."
-        )
-        
-        os_hint = (
-            "This is a Windows system using cmd.exe. Avoid using bash-specific syntax."
-            if self.is_windows else
-            "This is a Unix-like system. Use standard bash commands."
-        )
-        
-        context += f"\n\nImportant notes: {file_creation_hint} {os_hint}"
+            message += f"\n\nPrevious attempt feedback: {feedback}"
+            call_type = "continuation"
 
-        if self.api_type == "openai":
-            return self._generate_plan_openai(context)
-        elif self.api_type == "gemini":
-            return self._generate_plan_gemini(context)
-        raise ValueError(f"Unsupported API type: {self.api_type}")
+        plan = self._complete(call_type, self.plan_instructions, message, self._parse_plan)
+        return plan or []
 
-    def _generate_plan_openai(self, context: str) -> List[Dict[str, str]]:
-        prompt = f"""
-        You are an AI agent that generates executable commands for a computer.
-        Based on the task description, generate a sequence of commands to achieve the task.
-        
-        IMPORTANT GUIDELINES:
-        1. For empty files use: 'touch filename'
-        2. For files that need content, use this special format: 
-           WRITE_FILE:filename:file_content_here
-           (This is a special command our system understands)
-        3. For C programs:
-           - Always add 'fflush(stdout);' after printf statements without newlines
-           - Example: printf("Enter number: "); fflush(stdout);
-        4. For C++ programs:
-           - Use 'std::cout << "Prompt: " << std::flush;' for immediate display
-        5. Include proper compilation commands with appropriate flags
-        
-        For each step include:
-        1. A description of what the command does
-        2. The exact command to run
-
-        Task: {context}
-
-        Format your response as a JSON array of objects with 'description' and 'command' keys.
-        Example:
-        [
-            {{"description": "Create a directory for the project", "command": "mkdir project"}},
-            {{"description": "Create a C file with proper output handling", "command": "WRITE_FILE:add.c:#include <stdio.h>\\n\\nint main() {{\\n    int a, b;\\n    printf(\\"Enter first number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &a);\\n    printf(\\"Enter second number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &b);\\n    printf(\\"Sum: %d\\n\\", a+b);\\n    return 0;\\n}}"}},
-            {{"description": "Compile the C program", "command": "gcc -o add add.c"}},
-            {{"description": "Run the program", "command": "./add"}}
-        ]
+    def _parse_plan(self, content: str) -> Optional[List[Dict[str, str]]]:
+        try:
+            json_match = re.search(r'\[\s*{.*}\s*\]', content, re.DOTALL)
+            if json_match:
+                content = json_match.group(0)
+            content = content.replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(content)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing API response: {e}")
+            print(f"Raw response: {content}")
+            return None
+        if not isinstance(parsed, list) or not all(
+            isinstance(step, dict) and 'description' in step and 'command' in step for step in parsed
+        ):
+            print(f"Unexpected plan format: {content}")
+            return None
+        return parsed
+
+    def _complete(self, call_type: str, instructions: str, message: str, parse: Callable[[str], Any]) -> Any:
+        """Run a call on the routed model, falling back to the next one if the request fails.
+
+        Returns the parsed reply, or None if no model produced a usable one.
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        for route in self.router.rank(call_type):
+            print(f"Querying {route['provider'].capitalize()} model: {route['model']}")
+            started = time.monotonic()
+            if route["provider"] == "openai":
+                content = self._chat_openai(route, instructions, message)
+            else:
+                content = self._chat_gemini(route, instructions, message)
+            latency = time.monotonic() - started
+
+            if content is None:
+                self.router.record(call_type, route, latency, succeeded=False, parsed=False)
+                continue
+            result = parse(content)
+            self.router.record(call_type, route, latency, succeeded=True, parsed=result is not None)
+            return result
+        return None
+
+    def _route_api_key(self, route: Dict[str, Any]) -> Optional[str]:
+        # Routes to third-party endpoints have no key unless configured with one
+        if not route["api_key_env"]:
+            return None
+        api_key = os.getenv(route["api_key_env"])
+        if not api_key and route["api_key_env"] == API_KEY_ENV.get(self.api_type):
+            api_key = self.api_key
+        return api_key
+
+    def _chat_openai(self, route: Dict[str, Any], instructions: str, message: str) -> Optional[str]:
+        """Send static instructions plus a variable message to an OpenAI-compatible endpoint."""
+        headers = {"Content-Type": "application/json"}
+        api_key = self._route_api_key(route)
+        # Local OpenAI-compatible servers usually don't need a key
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        # OpenAI caches long prompt prefixes automatically; keeping the
+        # instructions first and byte-identical is all it needs
         payload = {
-            "model": "gpt-3.5-turbo",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2
+            "model": route["model"],
+            "messages": [
+                {"role": "system", "content": instructions},
+                {"role": "user", "content": message}
+            ],
+            "temperature": route["temperature"]
         }
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        if route["max_tokens"]:
+            payload["max_tokens"] = route["max_tokens"]
+
+        try:
+            response = requests.post(
+                f"{route['base_url'].rstrip('/')}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=self.request_timeout
+            )
+        except requests.RequestException as e:
+            print(f"Error: could not reach {route['base_url']}: {e}")
+            return None
         if response.status_code != 200:
             print(f"Error: API returned status code {response.status_code}")
             print(response.text)
-            return []
+            return None
 
         result = response.json()
-        content = result["choices"][0]["message"]["content"]
-
+        usage = result.get("usage") or {}
+        self._record_usage(
+            usage.get("prompt_tokens", 0),
+            (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        )
         try:
-            json_match = re.search(r'\[\s*{.*}\s*\]', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            return json.loads(content)
-        except json.JSONDecodeError as e:
+            return result["choices"][0]["message"]["content"]
+        except (KeyError, IndexError) as e:
             print(f"Error parsing API response: {e}")
-            print(f"Raw response: {content}")
-            return []
+            return None
 
-    def _generate_plan_gemini(self, context: str) -> List[Dict[str, str]]:
-        prompt = f"""
-        You are an AI agent that generates executable commands for a computer.
-        Based on the task description, generate a sequence of commands to achieve the task.
-        
-        IMPORTANT GUIDELINES:
-        1. For empty files use: 'touch filename'
-        2. For files that need content, use this special format: 
-           WRITE_FILE:filename:file_content_here
-           (This is a special command our system understands)
-        3. For C programs:
-           - Always add 'fflush(stdout);' after printf statements without newlines
-           - Example: printf("Enter number: "); fflush(stdout);
-        4. For C++ programs:
-           - Use 'std::cout << "Prompt: " << std::flush;' for immediate display
-        5. Include proper compilation commands with appropriate flags
-        
-        For each step include:
-        1. A description of what the command does
-        2. The exact command to run
-
-        Task: {context}
-
-        Format your response as a JSON array of objects with 'description' and 'command' keys.
-        Example:
-        [
-            {{"description": "Create a directory for the project", "command": "mkdir project"}},
-            {{"description": "Create a C file with proper output handling", "command": "WRITE_FILE:add.c:#include <stdio.h>\\n\\nint main() {{\\n    int a, b;\\n    printf(\\"Enter first number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &a);\\n    printf(\\"Enter second number: \\"); fflush(stdout);\\n    scanf(\\"%d\\", &b);\\n    printf(\\"Sum: %d\\n\\", a+b);\\n    return 0;\\n}}"}},
-            {{"description": "Compile the C program", "command": "gcc -o add add.c"}},
-            {{"description": "Run the program", "command": "./add"}}
-        ]
-        Return ONLY the JSON array and no other text.
-        """
+    def _chat_gemini(self, route: Dict[str, Any], instructions: str, message: str) -> Optional[str]:
+        """Send static instructions plus a variable message to Gemini and return the reply text."""
+        api_key = self._route_api_key(route)
+        if not api_key:
+            print(f"Error: {route['api_key_env']} is not set.")
+            return None
+        model = route["model"]
         headers = {"Content-Type": "application/json"}
         payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
+            "contents": [{"role": "user", "parts": [{"text": message}]}],
             "generationConfig": {
-                "temperature": 0.2,
+                "temperature": route["temperature"],
                 "topK": 32,
                 "topP": 1,
-                "maxOutputTokens": 1024
+                "maxOutputTokens": route["max_tokens"] or 1024
             }
         }
 
-        model = "gemini-2.0-flash"
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={self.api_key}"
+        cached_content = None
+        if self.prompt_cache and self.prompt_cache.api_key == api_key:
+            cached_content = self.prompt_cache.get(model, instructions)
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        else:
+            payload["systemInstruction"] = {"parts": [{"text": instructions}]}
+
+        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+        try:
+            response = requests.post(api_url, headers=headers, json=payload, timeout=self.request_timeout)
 
-        print(f"Querying Gemini model: {model}")
-        response = requests.post(api_url, headers=headers, json=payload)
+            # The cache may have expired or been deleted server-side; resend
+            # inline. Rate limits and server errors say nothing about the
+            # cache, so those keep it and fail as usual.
+            if cached_content and response.status_code in (400, 403, 404):
+                self.prompt_cache.invalidate(model, instructions)
+                payload = {key: value for key, value in payload.items() if key != "cachedContent"}
+                payload["systemInstruction"] = {"parts": [{"text": instructions}]}
+                response = requests.post(api_url, headers=headers, json=payload, timeout=self.request_timeout)
+        except requests.RequestException as e:
+            print(f"Error: could not reach Gemini: {e}")
+            return None
 
         if response.status_code != 200:
             print(f"Error: API returned status code {response.status_code}")
             print(response.text)
-            return []
+            return None
 
         result = response.json()
-
+        usage = result.get("usageMetadata", {})
+        self._record_usage(usage.get("promptTokenCount", 0), usage.get("cachedContentTokenCount", 0))
         try:
-            content = result["candidates"][0]["content"]["parts"][0]["text"]
-            json_match = re.search(r'\[\s*{.*}\s*\]', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            content = content.replace("```json", "").replace("```", "").strip()
-            parsed = json.loads(content)
-            return parsed if isinstance(parsed, list) else []
-        except (KeyError, json.JSONDecodeError) as e:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError) as e:
             print(f"Error parsing Gemini response: {e}")
             print(f"Raw response: {json.dumps(result, indent=2)}")
-            return []
+            return None
+
+    def _record_usage(self, prompt_tokens: int, cached_tokens: int) -> None:
+        """Accumulate prompt token counts, including those served from a prompt cache."""
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["cached_tokens"] += cached_tokens
+        if prompt_tokens:
+            print(f"Prompt tokens: {prompt_tokens} ({cached_tokens} cached)")
 
     def _write_file(self, filename: str, content: str) -> bool:
         """Write content to a file."""
-        try:
-            # Create directory if it doesn't exist
-            directory = os.path.dirname(filename)
-            if directory and not os.path.exists(directory):
-                os.makedirs(directory, exist_ok=True)
-                
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(content)
-            return True
-        except Exception as e:
-            print(f"Error writing file {filename}: {e}")
-            return False
+        return self._write_files([(filename, content)]) is None
+
+    def _write_files(self, files: List[Tuple[str, str]]) -> Optional[str]:
+        """Write several files at once, atomically per file.
+
+        Returns None on success, or the name of the file that could not be written.
+        """
+        failure = write_files(files, fsync=self.fsync_writes)
+        if failure is None:
+            return None
+        filename, error = failure
+        print(f"Error writing file {filename}: {error}")
+        return filename
 
     def display_plan(self, plan: List[Dict[str, str]]) -> None:
         print("\nGenerated Task Plan:")
@@ -282,6 +433,8 @@ class TaskAgent:
             print("-" * 50)
 
     def get_approval(self) -> bool:
+        if not self.interactive:
+            return True
         while True:
             response = input("\nDo you approve this plan? (y/n): ").strip().lower()
             if response in ['y', 'yes']:
@@ -293,73 +446,15 @@ class TaskAgent:
         """Use AI to diagnose error and suggest a fix."""
         print("\nDiagnosing error...")
         
-        prompt = f"""
-        You are a helpful debugging assistant. A command has failed during execution.
-        
-        Command: {command}
-        Step Description: {step_description}
-        Error Output: {error_message}
-        
-        Please analyze the error and provide:
-        1. A brief explanation of what went wrong
-        2. A concrete solution to fix the issue
-        3. The exact command(s) needed to resolve the problem
-        
-        Format your response as a JSON object with keys:
-        - "explanation": Brief description of the error
-        - "solution": How to fix it
-        - "commands": Array of commands to execute to fix the issue
-        
-        Example:
-        {{
-            "explanation": "The C compiler is not finding the math library.",
-            "solution": "Need to explicitly link the math library with -lm flag",
-            "commands": ["gcc -o program program.c -lm"]
-        }}
-        
-        Return ONLY the JSON object and no other text.
-        """
-        
-        if self.api_type == "openai":
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.2
-            }
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            if response.status_code != 200:
-                print(f"Error: API returned status code {response.status_code}")
-                return None
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            
-        elif self.api_type == "gemini":
-            headers = {"Content-Type": "application/json"}
-            payload = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "temperature": 0.2,
-                    "topK": 32,
-                    "topP": 1,
-                    "maxOutputTokens": 1024
-                }
-            }
-            
-            model = "gemini-2.0-flash"
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={self.api_key}"
-            
-            response = requests.post(api_url, headers=headers, json=payload)
-            if response.status_code != 200:
-                print(f"Error: API returned status code {response.status_code}")
-                return None
-                
-            result = response.json()
-            content = result["candidates"][0]["content"]["parts"][0]["text"]
+        message = (
+            f"Command: {command}\n"
+            f"Step Description: {step_description}\n"
+            f"Error Output: {error_message}"
+        )
         
+        return self._complete("diagnosis", DIAGNOSIS_INSTRUCTIONS, message, self._parse_diagnosis)
+
+    def _parse_diagnosis(self, content: str) -> Optional[Dict[str, Any]]:
         try:
             # Extract JSON from response
             json_match = re.search(r'{.*}', content, re.DOTALL)
@@ -367,11 +462,45 @@ class TaskAgent:
                 content = json_match.group(0)
             content = content.replace("```json", "").replace("```", "").strip()
             diagnosis = json.loads(content)
-            return diagnosis
-        except (json.JSONDecodeError, KeyError) as e:
+        except json.JSONDecodeError as e:
             print(f"Error parsing API diagnosis response: {e}")
             print(f"Raw response: {content}")
             return None
+        return diagnosis if isinstance(diagnosis, dict) else None
+
+    def diagnose_error_candidates(self, error_message: str, command: str, step_description: str, count: int) -> List[Dict[str, Any]]:
+        """Use AI to suggest several alternative fixes for an error in one request."""
+        print(f"\nDiagnosing error ({count} candidate fixes)...")
+        
+        message = (
+            f"Number of alternatives: {count}\n"
+            f"Command: {command}\n"
+            f"Step Description: {step_description}\n"
+            f"Error Output: {error_message}"
+        )
+        
+        candidates = self._complete("diagnosis", CANDIDATE_DIAGNOSIS_INSTRUCTIONS, message, self._parse_candidates)
+        return (candidates or [])[:count]
+
+    def _parse_candidates(self, content: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            json_match = re.search(r'\[.*\]', content, re.DOTALL)
+            if json_match:
+                content = json_match.group(0)
+            content = content.replace("```json", "").replace("```", "").strip()
+            candidates = json.loads(content)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing API diagnosis response: {e}")
+            print(f"Raw response: {content}")
+            return None
+        
+        if not isinstance(candidates, list):
+            return None
+        candidates = [
+            candidate for candidate in candidates
+            if isinstance(candidate, dict) and candidate.get('commands')
+        ]
+        return candidates or None
 
     def execute_plan(self, plan: List[Dict[str, str]]) -> List[Tuple[Dict[str, str], bool, str]]:
         results = []
@@ -386,20 +515,38 @@ class TaskAgent:
             if command.startswith("WRITE_FILE:"):
                 parts = command.split(':', 2)
                 if len(parts) >= 3:
-                    filename = parts[1]
-                    content = parts[2]
-                    print(f"Writing content to {filename}")
-                    success = self._write_file(filename, content)
-                    if success:
-                        print(f"Successfully created {filename}")
-                        results.append((step, True, f"Created {filename}"))
+                    # Write this and the directly following WRITE_FILE steps as one batch
+                    batch = [(step, parts)]
+                    for next_step in plan[current_step + 1:]:
+                        next_parts = next_step['command'].split(':', 2)
+                        if not next_step['command'].startswith("WRITE_FILE:") or len(next_parts) < 3:
+                            break
+                        batch.append((next_step, next_parts))
+                    
+                    for i, (batch_step, (_, filename, _)) in enumerate(batch):
+                        if i:
+                            print(f"\nExecuting Step {current_step + i + 1}: {batch_step['description']}")
+                        print(f"Writing content to {filename}")
+                    failed = self._write_files([(filename, content) for _, (_, filename, content) in batch])
+                    if failed is None:
+                        for batch_step, (_, filename, _) in batch:
+                            print(f"Successfully created {filename}")
+                            results.append((batch_step, True, f"Created {filename}"))
+                        # The last step of the batch is counted below
+                        current_step += len(batch) - 1
                     else:
+                        # Blame the step that wrote the failing file
+                        failed_step, filename = next(
+                            ((batch_step, name) for batch_step, (_, name, _) in batch
+                             if os.path.realpath(name) == os.path.realpath(failed)),
+                            (step, parts[1])
+                        )
                         error_msg = f"Failed to create {filename}"
                         print(f"{error_msg}")
                         
                         # Attempt error recovery
-                        if not self.attempt_recovery(error_msg, command, step['description']):
-                            results.append((step, False, error_msg))
+                        if not self.attempt_recovery(error_msg, failed_step['command'], failed_step['description']):
+                            results.append((failed_step, False, error_msg))
                             break
                         continue
                 else:
@@ -416,23 +563,17 @@ class TaskAgent:
                 print(f"Command: {command}")
                 try:
                     # Use interactive mode for program execution to handle stdio properly
-                    if self._is_program_execution(command):
+                    if self.interactive and self._is_program_execution(command):
                         print("\n--- Program Output Start ---")
-                        # Run process with interactive stdin/stdout for program execution
-                        process = subprocess.Popen(
-                            command, 
-                            shell=True,
-                            stdin=None,  # Use terminal's stdin
-                            stdout=None, # Use terminal's stdout
-                            stderr=None, # Use terminal's stderr
-                            text=True
-                        )
-                        process.wait()
-                        print("--- Program Output End ---\n")
+                        # Run on a terminal the user can type into, keeping a transcript for diagnosis
+                        returncode, transcript = run_interactive(command, self.transcript_limit)
+                        print("\n--- Program Output End ---\n")
                         
-                        if process.returncode != 0:
-                            error_msg = f"Program exited with code {process.returncode}"
+                        if returncode != 0:
+                            error_msg = f"Program exited with code {returncode}"
                             print(f"{error_msg}")
+                            if transcript:
+                                error_msg += f"\n\nProgram output (most recent last):\n{transcript}"
                             
                             # Attempt error recovery
                             if not self.attempt_recovery(error_msg, command, step['description']):
@@ -440,15 +581,10 @@ class TaskAgent:
                                 break
                             continue
                         
-                        results.append((step, True, "Interactive execution"))
+                        results.append((step, True, transcript or "Interactive execution"))
                     else:
                         # Standard command execution for non-program commands
-                        process = subprocess.run(
-                            command, 
-                            shell=True, 
-                            text=True, 
-                            capture_output=True
-                        )
+                        process = self._run_captured(command)
                         
                         if process.returncode != 0:
                             error_msg = process.stderr if process.stderr else f"Command failed with exit code {process.returncode}"
@@ -494,6 +630,9 @@ class TaskAgent:
         self.error_recovery_attempts += 1
         print(f"\nAttempting recovery (attempt {self.error_recovery_attempts}/{self.max_recovery_attempts})...")
         
+        if self.recovery_candidates > 1:
+            return self._attempt_parallel_recovery(error_message, command, step_description)
+        
         # Get AI diagnosis and fix
         diagnosis = self.diagnose_error(error_message, command, step_description)
         if not diagnosis:
@@ -516,8 +655,7 @@ class TaskAgent:
         for i, cmd in enumerate(fix_commands, 1):
             print(f"  {i}. {cmd}")
             
-        response = input("\nExecute these commands to fix the issue? (y/n): ").strip().lower()
-        if response not in ['y', 'yes']:
+        if not self._confirm("\nExecute these commands to fix the issue? (y/n): "):
             print("Fix rejected.")
             return False
             
@@ -538,7 +676,7 @@ class TaskAgent:
                             print(f"Failed to create/update {filename}")
                             return False
                 else:
-                    process = subprocess.run(cmd, shell=True, text=True, capture_output=True)
+                    process = self._run_captured(cmd)
                     if process.returncode != 0:
                         print(f"Fix command failed: {process.stderr}")
                         return False
@@ -554,9 +692,303 @@ class TaskAgent:
         print("\nRecovery attempt complete. Retrying the original step...")
         # Reset this attempt since we're about to retry
         self.error_recovery_attempts -= 1
-        time.sleep(1)  # Brief pause to let user read messages
+        if self.interactive:
+            time.sleep(1)  # Brief pause to let user read messages
         return True
     
+    def _attempt_parallel_recovery(self, error_message: str, command: str, step_description: str) -> bool:
+        """Verify several candidate fixes in parallel and promote the first that works."""
+        candidates = self.diagnose_error_candidates(error_message, command, step_description, self.recovery_candidates)
+        if not candidates:
+            print("Failed to diagnose the error.")
+            return False
+        
+        print("\nProposed Fixes:")
+        for i, diagnosis in enumerate(candidates, 1):
+            print(f"\nCandidate {i}:")
+            print(f"  Problem: {diagnosis.get('explanation', 'Unknown error')}")
+            print(f"  Solution: {diagnosis.get('solution', 'No solution provided')}")
+            for j, cmd in enumerate(diagnosis['commands'], 1):
+                print(f"    {j}. {cmd}")
+        
+        if not self._confirm("\nTry these fixes in isolated workspaces and apply the first that works? (y/n): "):
+            print("Fix rejected.")
+            return False
+        
+        workspace = os.getcwd()
+        # Taken once: every candidate's changes are measured against it
+        baseline = self._snapshot(workspace)
+        cancelled = threading.Event()
+        sandboxes = []
+        winner = None
+        
+        print(f"\nVerifying {len(candidates)} candidate fixes in parallel...")
+        try:
+            # Created here, so they are cleaned up even if verification is interrupted
+            for _ in candidates:
+                sandboxes.append(self._make_sandbox(workspace))
+            with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+                futures = {
+                    pool.submit(self._verify_candidate, sandbox, workspace, baseline,
+                                diagnosis['commands'], command, cancelled): (i, sandbox)
+                    for i, (diagnosis, sandbox) in enumerate(zip(candidates, sandboxes), 1)
+                }
+                try:
+                    for future in as_completed(futures):
+                        index, sandbox = futures[future]
+                        passed, detail, changes = future.result()
+                        if passed and winner is None:
+                            print(f"  Candidate {index}: passed")
+                            winner = (index, sandbox, changes)
+                            # Stop the remaining candidates, they are no longer needed
+                            cancelled.set()
+                        elif not passed and detail != "cancelled":
+                            print(f"  Candidate {index}: failed ({detail})")
+                except BaseException:
+                    # Interrupted: don't leave the candidates running until their timeout
+                    cancelled.set()
+                    raise
+            
+            if winner is None:
+                print("None of the candidate fixes resolved the error.")
+                return False
+            
+            index, sandbox, changes = winner
+            print(f"\nApplying candidate {index} to {workspace}...")
+            self._promote_changes(os.path.join(sandbox, "changes"), changes, workspace)
+        finally:
+            for sandbox in sandboxes:
+                shutil.rmtree(sandbox, ignore_errors=True)
+        
+        print("\nRecovery attempt complete. Retrying the original step...")
+        # Reset this attempt since we're about to retry
+        self.error_recovery_attempts -= 1
+        return True
+
+    def _verify_candidate(self, sandbox: str, workspace: str, baseline: Dict[str, Tuple[int, int, int]],
+                          fix_commands: List[str], command: str, cancelled: threading.Event
+                          ) -> Tuple[bool, str, Dict[str, Optional[Tuple[int, int, int]]]]:
+        """Apply fix commands in a copy of the workspace and re-run the failed command there.
+
+        What the fix changed is set aside before the failed command runs, so
+        only the fix gets promoted; the step itself is then run once, in the
+        live tree, by execute_plan.
+        """
+        changes = {}
+        try:
+            clone = os.path.join(sandbox, "workspace")
+            self._clone_workspace(workspace, clone)
+            
+            passed, detail = self._run_candidate_commands(fix_commands, clone, cancelled)
+            if not passed:
+                return False, detail, changes
+            if cancelled.is_set():
+                return False, "cancelled", changes
+            
+            changes = self._save_changes(baseline, clone, os.path.join(sandbox, "changes"))
+            passed, detail = self._run_candidate_commands([command], clone, cancelled)
+            return passed, detail, changes
+        except Exception as e:
+            return False, str(e), changes
+
+    @staticmethod
+    def _make_sandbox(workspace: str) -> str:
+        """Create a candidate directory, on the workspace's filesystem where possible.
+
+        Reflink copies only share data within one filesystem, and the system
+        temp dir is often tmpfs or another disk.
+        """
+        parent = os.path.dirname(workspace)
+        # The filesystem root has no parent to put the copy next to
+        if parent != workspace:
+            try:
+                return tempfile.mkdtemp(prefix=".taskgpt-candidate-", dir=parent)
+            except OSError:
+                pass
+        return tempfile.mkdtemp(prefix="taskgpt-candidate-")
+
+    def _run_candidate_commands(self, commands: List[str], clone: str,
+                                cancelled: threading.Event) -> Tuple[bool, str]:
+        """Run commands inside a workspace copy, stopping at the first failure."""
+        for cmd in commands:
+            if cancelled.is_set():
+                return False, "cancelled"
+            if cmd.startswith("WRITE_FILE:"):
+                parts = cmd.split(':', 2)
+                if len(parts) < 3:
+                    return False, "invalid WRITE_FILE command format"
+                target = os.path.realpath(os.path.join(clone, parts[1]))
+                root = os.path.realpath(clone)
+                # Absolute paths and ".." would write outside the throwaway copy
+                if os.path.commonpath([target, root]) != root:
+                    return False, f"{parts[1]} is outside the workspace"
+                if not self._write_file(target, parts[2]):
+                    return False, f"could not write {parts[1]}"
+                continue
+            returncode, stderr = self._run_in_sandbox(cmd, clone, cancelled)
+            if returncode != 0:
+                if returncode is None:
+                    if cancelled.is_set():
+                        return False, "cancelled"
+                    return False, f"'{cmd}' timed out"
+                detail = stderr.strip().splitlines()[-1] if stderr.strip() else f"exit code {returncode}"
+                return False, f"'{cmd}': {detail}"
+        return True, "passed"
+
+    def _run_in_sandbox(self, command: str, cwd: str, cancelled: threading.Event) -> Tuple[Optional[int], str]:
+        """Run a command non-interactively, killing it on timeout or cancellation."""
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            # Own process group, so the shell's children are stopped along with it
+            start_new_session=not self.is_windows
+        )
+        deadline = time.monotonic() + self.candidate_timeout
+        while True:
+            try:
+                _, stderr = process.communicate(timeout=0.2)
+                return process.returncode, stderr
+            except subprocess.TimeoutExpired:
+                if cancelled.is_set() or time.monotonic() > deadline:
+                    self._kill_process_group(process)
+                    _, stderr = process.communicate()
+                    return None, stderr
+
+    def _run_captured(self, command: str) -> subprocess.CompletedProcess:
+        """Run a non-interactive command and capture its output.
+
+        Headless agents give the command no stdin and stop it after
+        command_timeout seconds (raising TimeoutExpired), so it can't hang
+        a worker.
+        """
+        new_session = self.command_timeout is not None and not self.is_windows
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            text=True,
+            stdin=None if self.interactive else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # Own process group when it may have to be killed, so the shell's
+            # children go too and don't keep the pipes open
+            start_new_session=new_session
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=self.command_timeout)
+        except BaseException:
+            # Timeout, Ctrl-C or a lost lease: a process in its own session
+            # doesn't get the terminal's SIGINT, so stop it here
+            if new_session:
+                self._kill_process_group(process)
+            else:
+                process.kill()
+            process.communicate()
+            raise
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    def _kill_process_group(self, process: subprocess.Popen) -> None:
+        """Kill a process started with start_new_session, and its children."""
+        if self.is_windows:
+            process.kill()
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _clone_workspace(self, source: str, target: str) -> None:
+        """Copy the workspace, sharing file data copy-on-write where the filesystem allows it."""
+        if not self.is_windows and shutil.which("cp"):
+            # GNU cp clones extents on btrfs/xfs/etc. and falls back to a plain copy elsewhere
+            result = subprocess.run(["cp", "-a", "--reflink=auto", source, target], capture_output=True)
+            if result.returncode == 0:
+                return
+            shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target, symlinks=True)
+
+    @staticmethod
+    def _snapshot(root: str) -> Dict[str, Tuple[int, int, int]]:
+        """Mode, size and mtime of every entry under root, keyed by relative path."""
+        entries = {".": (os.lstat(root).st_mode, 0, 0)}
+        for dirpath, dirs, files in os.walk(root):
+            for name in dirs + files:
+                path = os.path.join(dirpath, name)
+                st = os.lstat(path)
+                # A directory's size and mtime follow its entries; only its mode matters
+                if stat.S_ISDIR(st.st_mode):
+                    entry = (st.st_mode, 0, 0)
+                else:
+                    entry = (st.st_mode, st.st_size, st.st_mtime_ns)
+                entries[os.path.relpath(path, root)] = entry
+        return entries
+
+    def _save_changes(self, baseline: Dict[str, Tuple[int, int, int]], clone: str,
+                      target: str) -> Dict[str, Optional[Tuple[int, int, int]]]:
+        """Copy the entries of clone that differ from baseline into target.
+
+        Clones keep mtimes, so anything the fix didn't touch compares equal.
+        Returns the changed paths with their new snapshot entry, or None for
+        paths the fix deleted.
+        """
+        current = self._snapshot(clone)
+        changes = {rel: entry for rel, entry in current.items() if baseline.get(rel) != entry}
+        changes.update({rel: None for rel in baseline if rel not in current})
+        for rel, entry in sorted(changes.items()):
+            if entry is None:
+                continue
+            src = os.path.join(clone, rel)
+            dst = os.path.normpath(os.path.join(target, rel))
+            if stat.S_ISDIR(entry[0]):
+                os.makedirs(dst, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if stat.S_ISLNK(entry[0]):
+                os.symlink(os.readlink(src), dst)
+            else:
+                shutil.copy2(src, dst)
+        return changes
+
+    def _promote_changes(self, source: str, changes: Dict[str, Optional[Tuple[int, int, int]]], target: str) -> None:
+        """Apply changes saved by _save_changes to target."""
+        # Parents sort before their children
+        for rel, entry in sorted(changes.items()):
+            dst = os.path.normpath(os.path.join(target, rel))
+            if entry is None or not stat.S_ISDIR(entry[0]):
+                self._remove(dst)
+            if entry is None:
+                continue
+            if stat.S_ISDIR(entry[0]):
+                if os.path.islink(dst) or (os.path.lexists(dst) and not os.path.isdir(dst)):
+                    os.remove(dst)
+                os.makedirs(dst, exist_ok=True)
+                os.chmod(dst, stat.S_IMODE(entry[0]))
+                continue
+            src = os.path.normpath(os.path.join(source, rel))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if stat.S_ISLNK(entry[0]):
+                os.symlink(os.readlink(src), dst)
+            else:
+                shutil.copy2(src, dst)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    def _confirm(self, prompt: str) -> bool:
+        """Ask a yes/no question; headless agents always answer yes."""
+        if not self.interactive:
+            return True
+        response = input(prompt).strip().lower()
+        return response in ['y', 'yes']
+
     def _is_program_execution(self, command: str) -> bool:
         """Check if the command is executing a program rather than a shell command."""
         # List of shell commands that shouldn't trigger interactive mode
@@ -582,7 +1014,9 @@ class TaskAgent:
             
         return False
 
-    def check_success(self) -> bool:
+    def check_success(self, plan: List[Dict[str, str]], results: List[Tuple[Dict[str, str], bool, str]]) -> bool:
+        if not self.interactive:
+            return len(results) == len(plan) and all(ok for _, ok, _ in results)
         while True:
             response = input("\nWas the task successfully completed? (y/n): ").strip().lower()
             if response in ['y', 'yes']:
@@ -590,37 +1024,61 @@ class TaskAgent:
             elif response in ['n', 'no']:
                 return False
 
-    def get_feedback(self) -> str:
+    def get_feedback(self, results: List[Tuple[Dict[str, str], bool, str]]) -> str:
+        if not self.interactive:
+            failed = [(step, output) for step, ok, output in results if not ok]
+            if not failed:
+                return "The plan stopped before all steps were executed."
+            step, output = failed[-1]
+            return f"Step '{step['description']}' ({step['command']}) failed with: {output.strip()[-2000:]}"
         print("\nPlease explain why the task failed or what needs to be fixed:")
         return input("> ").strip()
 
-    def run_task(self, task_description: str) -> None:
+    def run_task(self, task_description: str) -> bool:
         feedback = None
         success = False
+        attempts = 0
 
         while not success:
+            attempts += 1
+            if not self.interactive and attempts > self.max_plan_attempts:
+                print(f"Giving up after {self.max_plan_attempts} plan attempts.")
+                return False
             print(f"\nProcessing task: {task_description}")
             plan = self.generate_plan(task_description, feedback)
             if not plan:
                 print("Failed to generate a plan. Please try again with a clearer task description.")
-                return
+                return False
             self.display_plan(plan)
             if not self.get_approval():
                 print("Plan rejected. Exiting.")
-                return
-            self.execute_plan(plan)
-            success = self.check_success()
+                return False
+            self.last_results = self.execute_plan(plan)
+            success = self.check_success(plan, self.last_results)
             if not success:
-                feedback = self.get_feedback()
+                feedback = self.get_feedback(self.last_results)
                 print("Refining approach based on feedback...")
             else:
                 print("Task completed successfully!")
+        return True
 
 def run():
     parser = argparse.ArgumentParser(description='AI Task Agent')
     parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
     parser.add_argument('--api', type=str, default=DEFAULT_API, help=f'API to use (default: {DEFAULT_API})')
+    parser.add_argument('--models', type=str, default=None,
+                        help='Model routing config file (default: $TASKGPT_MODELS or ~/.taskgpt/models.json)')
+    parser.add_argument('--base-url', type=str, default=None,
+                        help='Base URL for OpenAI-compatible endpoints, e.g. a local server')
+    parser.add_argument('--model', type=str, default=None,
+                        help='Model to use for all calls instead of the built-in defaults')
     parser.add_argument('--max-recovery', type=int, default=3, help='Maximum number of recovery attempts per error')
+    parser.add_argument('--fsync', action='store_true',
+                        help='Flush files written by the plan to disk before continuing')
+    parser.add_argument('--recovery-candidates', type=int, default=1,
+                        help='Number of alternative fixes to verify in parallel per recovery attempt (default: 1)')
+    parser.add_argument('--candidate-timeout', type=int, default=120,
+                        help='Seconds allowed for verifying each candidate fix (default: 120)')
     args = parser.parse_args()
 
     print("=" * 50)
@@ -628,8 +1086,12 @@ def run():
     print("=" * 50)
 
     try:
-        agent = TaskAgent(api_type=args.api)
+        agent = TaskAgent(api_type=args.api, model_config=args.models, base_url=args.base_url,
+                          model=args.model)
         agent.max_recovery_attempts = args.max_recovery
+        agent.recovery_candidates = max(1, args.recovery_candidates)
+        agent.candidate_timeout = args.candidate_timeout
+        agent.fsync_writes = args.fsync
         task = input("Enter your task description: ")
         agent.run_task(task)
     except KeyboardInterrupt:
@@ -1,9 +1,18 @@
 # taskgpt/cli.py
 
+import sys
+
 from taskgpt.setup_env import run_setup_if_needed
 from taskgpt.agent import run
 
+QUEUE_COMMANDS = ("submit", "worker", "status")
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in QUEUE_COMMANDS:
+        # Queue commands run unattended, so skip the interactive setup
+        from taskgpt.worker import main as queue_main
+        sys.exit(queue_main(sys.argv[1:]))
+
     needs_restart = run_setup_if_needed()
     if needs_restart:
         return
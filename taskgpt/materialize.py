@@ -0,0 +1,143 @@
+# taskgpt/materialize.py
+
+import os
+import hashlib
+import tempfile
+from typing import List, Optional, Set, Tuple
+
+
+def _current_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Read once at import: os.umask can only be queried by setting it, which
+# would briefly affect files created by other threads
+FILE_MODE = 0o666 & ~_current_umask()
+
+
+class FileMaterializer:
+    """Writes a batch of files together.
+
+    Every file is first written to a temp file next to its destination.
+    Files whose content is already on disk are skipped, and if a file is
+    staged more than once the last content wins. Nothing is
+    replaced until all files are staged, and each destination is then
+    swapped in with os.replace, so readers never see a half-written file.
+    With fsync=True, data and directory entries are flushed to disk too.
+    """
+
+    def __init__(self, fsync: bool = False):
+        self.fsync = fsync
+        self.staged: List[Tuple[str, str]] = []
+        self.unchanged: List[str] = []
+        self.directories: Set[str] = set()
+
+    def stage(self, filename: str, content: str) -> None:
+        """Write content to a temp file for filename. Raises OSError on failure."""
+        # Write through symlinks, as open() would
+        path = os.path.realpath(filename)
+        # Match what text-mode open() would have written
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        data = content.encode("utf-8")
+
+        # A later write to the same file replaces an earlier one in the batch
+        self._discard(path)
+
+        if self._same_content(path, data):
+            self.unchanged.append(path)
+            return
+
+        directory = os.path.dirname(path)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            # mkstemp creates 0600 files; keep the mode a normal write would give
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = FILE_MODE
+            os.chmod(tmp_path, mode)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.staged.append((path, tmp_path))
+
+    def _discard(self, path: str) -> None:
+        for staged_path, tmp_path in list(self.staged):
+            if staged_path == path:
+                os.unlink(tmp_path)
+                self.staged.remove((staged_path, tmp_path))
+
+    def commit(self) -> None:
+        """Move all staged files into place.
+
+        If a replace fails, the files before it are already in place and
+        the rest are still staged (see abort).
+        """
+        while self.staged:
+            path, tmp_path = self.staged[0]
+            os.replace(tmp_path, path)
+            self.staged.pop(0)
+        if self.fsync and os.name != "nt":
+            for directory in self.directories:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def abort(self) -> None:
+        """Discard staged files that haven't been committed."""
+        for _, tmp_path in self.staged:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        self.staged = []
+
+    @staticmethod
+    def _same_content(path: str, data: bytes) -> bool:
+        try:
+            if os.path.getsize(path) != len(data) or not os.path.isfile(path):
+                return False
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    digest.update(chunk)
+        except OSError:
+            return False
+        return digest.digest() == hashlib.sha256(data).digest()
+
+
+def write_files(files: List[Tuple[str, str]], fsync: bool = False) -> Optional[Tuple[str, str]]:
+    """Stage and commit (filename, content) pairs.
+
+    Returns None on success, or (filename, error) for the file that failed.
+    A failure while staging leaves every file untouched; files are never
+    left half-written either way.
+    """
+    materializer = FileMaterializer(fsync=fsync)
+    for filename, content in files:
+        try:
+            materializer.stage(filename, content)
+        except OSError as e:
+            materializer.abort()
+            return filename, str(e)
+    try:
+        materializer.commit()
+    except OSError as e:
+        failed = materializer.staged[0][0] if materializer.staged else ""
+        materializer.abort()
+        return failed, str(e)
+    return None
@@ -0,0 +1,128 @@
+# taskgpt/prompt_cache.py
+
+import os
+import json
+import time
+import hashlib
+import requests
+from typing import Dict, Optional
+
+TASKGPT_HOME = os.path.expanduser(os.getenv("TASKGPT_HOME", "~/.taskgpt"))
+
+GEMINI_CACHE_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+
+# Gemini won't cache prefixes below this many tokens (OpenAI's automatic
+# caching has the same floor). Text averages about four characters a token.
+MIN_CACHE_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+
+def prefix_key(model: str, instructions: str) -> str:
+    """Stable key for a model and static instruction prefix."""
+    digest = hashlib.sha256(f"{model}\0{instructions}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class LocalPromptCache:
+    """In-memory stand-in for GeminiPromptCache, for tests. Makes no network calls."""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.entries: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, instructions: str) -> Optional[str]:
+        key = prefix_key(model, instructions)
+        if key in self.entries:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.entries[key] = f"cachedContents/local-{key}"
+        return self.entries[key]
+
+    def invalidate(self, model: str, instructions: str) -> None:
+        self.entries.pop(prefix_key(model, instructions), None)
+
+
+class GeminiPromptCache:
+    """Gemini `cachedContents` for static instruction prefixes.
+
+    Cache names are persisted under TASKGPT_HOME so later runs reuse the
+    server-side cache instead of creating a new one. Prefixes clearly below
+    the minimum cacheable size are sent inline without asking; ones the API
+    refuses anyway are remembered, so that refusal is not paid for on every
+    run.
+    """
+
+    RETRY_UNSUPPORTED_AFTER = 24 * 3600
+
+    def __init__(self, api_key: str, ttl: int = 3600, path: Optional[str] = None):
+        self.api_key = api_key
+        self.ttl = ttl
+        self.path = path or os.path.join(TASKGPT_HOME, "prompt_cache.json")
+        # Caches belong to the API key's project, so keep keys apart
+        self.owner = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        self.entries = self._load()
+
+    def get(self, model: str, instructions: str) -> Optional[str]:
+        """Return a cachedContents name for the prefix, creating it if needed."""
+        if len(instructions) < MIN_CACHE_TOKENS * CHARS_PER_TOKEN:
+            return None
+        key = self._key(model, instructions)
+        entry = self.entries.get(key)
+        # Leave a minute of slack so the cache doesn't expire mid-request
+        if entry and entry["expires"] > time.time() + 60:
+            return entry["name"]
+
+        name = self._create(model, instructions)
+        if name:
+            self.entries[key] = {"name": name, "expires": time.time() + self.ttl}
+        else:
+            self.entries[key] = {"name": None, "expires": time.time() + self.RETRY_UNSUPPORTED_AFTER}
+        self._save()
+        return name
+
+    def invalidate(self, model: str, instructions: str) -> None:
+        """Forget a cache the API no longer accepts."""
+        if self.entries.pop(self._key(model, instructions), None) is not None:
+            self._save()
+
+    def _key(self, model: str, instructions: str) -> str:
+        return f"{self.owner}:{prefix_key(model, instructions)}"
+
+    def _create(self, model: str, instructions: str) -> Optional[str]:
+        payload = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": instructions}]},
+            "ttl": f"{self.ttl}s"
+        }
+        try:
+            response = requests.post(
+                f"{GEMINI_CACHE_URL}?key={self.api_key}",
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=30
+            )
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.json().get("name")
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in entries.items() if entry.get("expires", 0) > now}
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+        except OSError:
+            pass  # caching is best effort
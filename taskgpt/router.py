@@ -0,0 +1,188 @@
+# taskgpt/router.py
+
+import os
+import json
+import time
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from taskgpt.prompt_cache import TASKGPT_HOME
+
+CALL_TYPES = ("plan", "diagnosis", "continuation")
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+API_KEY_ENV = {
+    "openai": "OPENAI_API_KEY",
+    "gemini": "GEMINI_API_KEY",
+}
+
+# Candidate models per call type, in order of preference until there are
+# enough observations to route on. Diagnosis replies are short and
+# structured, so a smaller model is tried first.
+DEFAULT_ROUTES = {
+    "openai": {
+        "plan": [{"model": "gpt-3.5-turbo"}],
+        "diagnosis": [{"model": "gpt-4o-mini"}, {"model": "gpt-3.5-turbo"}],
+        "continuation": [{"model": "gpt-3.5-turbo"}],
+    },
+    "gemini": {
+        "plan": [{"model": "gemini-2.0-flash"}],
+        "diagnosis": [{"model": "gemini-2.0-flash-lite"}, {"model": "gemini-2.0-flash"}],
+        "continuation": [{"model": "gemini-2.0-flash"}],
+    },
+}
+
+
+class ModelRouter:
+    """Picks a model for each call type from observed latency and reliability.
+
+    Routes come from DEFAULT_ROUTES for the agent's API, overridden per call
+    type by the "routes" section of the config file (TASKGPT_MODELS, or
+    models.json under TASKGPT_HOME):
+
+        {
+            "quality_threshold": 0.8,
+            "window": 50,
+            "max_age": 21600,
+            "routes": {
+                "diagnosis": [
+                    {"provider": "openai", "model": "llama3.2",
+                     "base_url": "http://localhost:11434/v1"}
+                ]
+            }
+        }
+
+    Each route may set provider, base_url, api_key_env, temperature and
+    max_tokens. OpenAI routes with a base_url other than api.openai.com
+    send no key unless api_key_env is set. For every (call type, model) the
+    router keeps the last `window` calls in a stats file, ignoring calls
+    older than `max_age` seconds. A model's quality is its success rate
+    times its parse-success rate; the fastest model (median latency) whose
+    quality meets the threshold is chosen. Models with fewer than
+    `min_samples` recent observations are tried first, in config order, so
+    a model demoted during an outage is tried again once its failures age
+    out. When a request fails, the agent falls back to the next model in
+    the ranking.
+    """
+
+    def __init__(self, api_type: str, config_path: Optional[str] = None, stats_path: Optional[str] = None,
+                 base_url: Optional[str] = None, model: Optional[str] = None):
+        if api_type not in DEFAULT_ROUTES:
+            raise ValueError(f"Unsupported API type: {api_type}")
+        self.api_type = api_type
+        self.config_path = config_path or os.getenv("TASKGPT_MODELS") or os.path.join(TASKGPT_HOME, "models.json")
+        self.stats_path = stats_path or os.path.join(TASKGPT_HOME, "model_stats.json")
+        self.base_url = base_url or os.getenv("TASKGPT_OPENAI_BASE_URL") or os.getenv("OPENAI_BASE_URL") or OPENAI_BASE_URL
+
+        config = self._load_json(self.config_path)
+        self.quality_threshold = config.get("quality_threshold", 0.8)
+        self.window = config.get("window", 50)
+        self.min_samples = config.get("min_samples", 3)
+        self.max_age = config.get("max_age", 6 * 3600)
+
+        if model:
+            routes = {call_type: [{"model": model}] for call_type in CALL_TYPES}
+        else:
+            routes = dict(DEFAULT_ROUTES[api_type])
+        routes.update(config.get("routes", {}))
+        self.routes = {
+            call_type: [self._normalize(route) for route in routes.get(call_type, [])]
+            for call_type in CALL_TYPES
+        }
+        for call_type, candidates in self.routes.items():
+            if not candidates:
+                raise ValueError(f"No models configured for '{call_type}' calls")
+
+        self.stats: Dict[str, List[List[Any]]] = self._load_json(self.stats_path)
+
+    def _normalize(self, route: Dict[str, Any]) -> Dict[str, Any]:
+        provider = route.get("provider", self.api_type)
+        if provider not in API_KEY_ENV:
+            raise ValueError(f"Unsupported provider in model config: {provider}")
+        base_url = route.get("base_url", self.base_url if provider == "openai" else None)
+        # Never send the OpenAI key to another server unless the config says so
+        default_key_env = API_KEY_ENV[provider]
+        if provider == "openai" and base_url.rstrip("/") != OPENAI_BASE_URL:
+            default_key_env = None
+        return {
+            "provider": provider,
+            "model": route["model"],
+            "base_url": base_url,
+            "api_key_env": route.get("api_key_env", default_key_env),
+            "temperature": route.get("temperature", 0.2),
+            "max_tokens": route.get("max_tokens"),
+        }
+
+    def uses_key(self, env_key: str) -> bool:
+        """Whether any route authenticates with the given environment variable."""
+        return any(route["api_key_env"] == env_key for routes in self.routes.values() for route in routes)
+
+    def _key(self, call_type: str, route: Dict[str, Any]) -> str:
+        return f"{call_type}|{route['provider']}|{route['base_url'] or ''}|{route['model']}"
+
+    def summary(self, call_type: str, route: Dict[str, Any]) -> Dict[str, Any]:
+        """Rolling-window statistics for one model on one call type."""
+        samples = self._recent(self.stats.get(self._key(call_type, route), []))
+        succeeded = [s for s in samples if s[2]]
+        latencies = sorted(s[1] for s in succeeded)
+        failure_rate = 1 - len(succeeded) / len(samples) if samples else 0.0
+        parse_rate = sum(1 for s in succeeded if s[3]) / len(succeeded) if succeeded else 0.0
+        return {
+            "samples": len(samples),
+            "latency": latencies[len(latencies) // 2] if latencies else None,
+            "failure_rate": failure_rate,
+            "parse_rate": parse_rate,
+            "quality": (1 - failure_rate) * parse_rate,
+        }
+
+    def rank(self, call_type: str) -> List[Dict[str, Any]]:
+        """Models to try for a call, best first. Later ones are fallbacks if a request fails."""
+        summaries = [(route, self.summary(call_type, route)) for route in self.routes[call_type]]
+
+        exploring = [route for route, summary in summaries if summary["samples"] < self.min_samples]
+        measured = [(route, summary) for route, summary in summaries if summary["samples"] >= self.min_samples]
+        qualified = sorted(
+            [(route, summary) for route, summary in measured
+             if summary["quality"] >= self.quality_threshold and summary["latency"] is not None],
+            key=lambda item: item[1]["latency"]
+        )
+        # Nothing else meets the bar; order the rest by reliability
+        unqualified = sorted(
+            [(route, summary) for route, summary in measured if (route, summary) not in qualified],
+            key=lambda item: -item[1]["quality"]
+        )
+        return exploring + [route for route, _ in qualified] + [route for route, _ in unqualified]
+
+    def record(self, call_type: str, route: Dict[str, Any], latency: float, succeeded: bool, parsed: bool) -> None:
+        """Add an observation and persist the window."""
+        # Merge with what other processes have written since we loaded
+        self.stats.update(self._load_json(self.stats_path))
+        key = self._key(call_type, route)
+        samples = self._recent(self.stats.get(key, [])) + [[time.time(), round(latency, 3), succeeded, parsed]]
+        self.stats[key] = samples[-self.window:]
+        self._save_stats()
+
+    def _recent(self, samples: List[List[Any]]) -> List[List[Any]]:
+        cutoff = time.time() - self.max_age
+        return [s for s in samples if s[0] >= cutoff]
+
+    def _save_stats(self) -> None:
+        try:
+            directory = os.path.dirname(self.stats_path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".model_stats.")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.stats, f)
+            os.replace(tmp_path, self.stats_path)
+        except OSError:
+            pass  # routing still works from in-memory stats
+
+    @staticmethod
+    def _load_json(path: str) -> Dict[str, Any]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
@@ -0,0 +1,174 @@
+# taskgpt/terminal.py
+
+import os
+import re
+import sys
+import subprocess
+from typing import Optional, Tuple
+
+try:
+    import pty
+    import tty
+    import fcntl
+    import select
+    import termios
+except ImportError:  # Windows
+    pty = None
+
+# CSI/OSC escape sequences and other control characters that mean nothing
+# once the output is read as plain text
+ANSI_ESCAPE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])')
+
+
+class Transcript:
+    """Keeps the last `limit` bytes of a program's output."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.data = bytearray()
+        self.truncated = False
+
+    def add(self, chunk: bytes) -> None:
+        self.data += chunk
+        if len(self.data) > self.limit:
+            del self.data[:len(self.data) - self.limit]
+            self.truncated = True
+
+    def text(self) -> str:
+        text = self.data.decode("utf-8", errors="replace")
+        # A pty turns a program's own "\r\n" into "\r\r\n"
+        text = re.sub(r"\r+\n", "\n", ANSI_ESCAPE.sub("", text)).replace("\r", "\n")
+        text = "".join(ch for ch in text if ch in "\n\t" or ch >= " ")
+        if self.truncated:
+            text = "[... earlier output truncated ...]\n" + text
+        return text.strip()
+
+
+def run_interactive(command: str, limit: int = 8192) -> Tuple[int, str]:
+    """Run a program attached to the user's terminal and record what it printed.
+
+    The program sees a real terminal (a pseudo-terminal where available), so
+    prompts and line buffering behave as if it were run directly, while its
+    output is also kept in a bounded transcript. Returns the exit code and
+    the transcript as plain text.
+    """
+    transcript = Transcript(limit)
+    if pty is not None:
+        returncode = _run_pty(command, transcript)
+    else:
+        returncode = _run_piped(command, transcript)
+    return returncode, transcript.text()
+
+
+def _run_pty(command: str, transcript: Transcript) -> int:
+    sys.stdout.flush()
+    pid, master = pty.fork()
+    if pid == 0:
+        # Child: the pty is now our controlling terminal and stdio
+        try:
+            os.execv("/bin/sh", ["/bin/sh", "-c", command])
+        finally:
+            os._exit(127)
+
+    stdin_fd = _fileno(sys.stdin)
+    stdout_fd = _fileno(sys.stdout)
+    saved_mode = None
+    if stdin_fd is not None and os.isatty(stdin_fd):
+        _copy_window_size(stdin_fd, master)
+        # Pass keystrokes straight through; the pty does echo and line editing
+        saved_mode = termios.tcgetattr(stdin_fd)
+        tty.setraw(stdin_fd)
+
+    status = None
+    try:
+        inputs = [master] + ([stdin_fd] if stdin_fd is not None else [])
+        while True:
+            readable, _, _ = select.select(inputs, [], [], 0.1)
+            if master in readable:
+                try:
+                    chunk = os.read(master, 4096)
+                except OSError:  # EIO once the program's side is closed
+                    chunk = b""
+                if not chunk:
+                    break
+                _write_all(stdout_fd, chunk)
+                transcript.add(chunk)
+            if stdin_fd in readable:
+                data = os.read(stdin_fd, 1024)
+                if data:
+                    _write_all(master, data)
+                else:
+                    # Our input ended; pass the EOF on and stop forwarding
+                    inputs.remove(stdin_fd)
+                    _write_all(master, b"\x04")
+            if not readable:
+                # A background child may hold the pty open after the program
+                # itself has exited; don't wait on it
+                waited, status = os.waitpid(pid, os.WNOHANG)
+                if waited:
+                    _drain(master, stdout_fd, transcript)
+                    break
+    finally:
+        if saved_mode is not None:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, saved_mode)
+        os.close(master)
+
+    if status is None:
+        _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def _run_piped(command: str, transcript: Transcript) -> int:
+    """Fallback without a pty: stdin stays on the terminal, output is teed through a pipe."""
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdin=None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    stdout_fd = _fileno(sys.stdout)
+    sys.stdout.flush()
+    while True:
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            break
+        _write_all(stdout_fd, chunk)
+        transcript.add(chunk)
+    process.stdout.close()
+    return process.wait()
+
+
+def _drain(fd: int, stdout_fd: Optional[int], transcript: Transcript) -> None:
+    while select.select([fd], [], [], 0)[0]:
+        try:
+            chunk = os.read(fd, 4096)
+        except OSError:
+            return
+        if not chunk:
+            return
+        _write_all(stdout_fd, chunk)
+        transcript.add(chunk)
+
+
+def _write_all(fd: Optional[int], data: bytes) -> None:
+    if fd is None:
+        return
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _fileno(stream) -> Optional[int]:
+    try:
+        return stream.fileno()
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _copy_window_size(source_fd: int, target_fd: int) -> None:
+    try:
+        size = fcntl.ioctl(source_fd, termios.TIOCGWINSZ, b"\0" * 8)
+        fcntl.ioctl(target_fd, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
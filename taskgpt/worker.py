@@ -0,0 +1,313 @@
+# taskgpt/worker.py
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import sqlite3
+import _thread
+import argparse
+import threading
+import contextlib
+from typing import Any, Dict, List, Optional
+
+from taskgpt.agent import TaskAgent, DEFAULT_API
+from taskgpt.prompt_cache import TASKGPT_HOME
+
+DEFAULT_QUEUE = os.path.join(TASKGPT_HOME, "queue.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    description TEXT NOT NULL,
+    api TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker TEXT,
+    lease_expires REAL,
+    heartbeat_at REAL,
+    workspace TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+"""
+
+
+class TaskQueue:
+    """SQLite-backed task queue with leases.
+
+    A worker owns a task only while its lease is current; it extends the
+    lease with heartbeats. Tasks whose lease runs out (the worker crashed or
+    lost its host) are put back in the queue until max_attempts is used up.
+    The database can live on a volume shared between hosts.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE):
+        # Absolute, as the worker changes directory into task workspaces
+        self.path = os.path.abspath(path)
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; transactions are opened explicitly where needed
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, description: str, api: str = DEFAULT_API, max_attempts: int = 3) -> int:
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "INSERT INTO tasks (description, api, max_attempts, created_at) VALUES (?, ?, ?, ?)",
+                (description, api, max_attempts, time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued task, re-queueing expired leases first."""
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front, so two workers can't
+            # both see the same task as queued
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(conn, now)
+                row = conn.execute(
+                    "SELECT * FROM tasks WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE tasks SET status = 'running', worker = ?, attempts = attempts + 1, "
+                    "lease_expires = ?, heartbeat_at = ?, started_at = ? WHERE id = ?",
+                    (worker, now + lease, now, now, row["id"])
+                )
+                # Return the task as claimed, not as it was queued
+                row = conn.execute("SELECT * FROM tasks WHERE id = ?", (row["id"],)).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row)
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', worker = NULL, finished_at = ?, result = ? "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+            (now, json.dumps({"error": "lease expired on the final attempt"}), now)
+        )
+        conn.execute(
+            "UPDATE tasks SET status = 'queued', worker = NULL, lease_expires = NULL "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now,)
+        )
+
+    def heartbeat(self, task_id: int, worker: str, lease: float) -> bool:
+        """Extend the lease. Returns False if the worker no longer owns the task."""
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, heartbeat_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + lease, now, task_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker: str, success: bool, result: Dict[str, Any], workspace: str) -> bool:
+        """Record the outcome. Returns False if the lease was lost in the meantime."""
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, workspace = ?, finished_at = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                ("done" if success else "failed", json.dumps(result), workspace, time.time(), task_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def tasks(self, task_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        with contextlib.closing(self._connect()) as conn:
+            if task_id is None:
+                rows = conn.execute("SELECT * FROM tasks ORDER BY id").fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchall()
+            return [dict(row) for row in rows]
+
+
+class Heartbeat(threading.Thread):
+    """Keeps a task lease alive while the agent works on it.
+
+    If the lease is lost, whether another worker took the task or renewals
+    kept failing until it ran out, the main thread is interrupted so the
+    agent stops working on a task it no longer owns.
+    """
+
+    def __init__(self, queue: TaskQueue, task_id: int, worker: str, lease: float):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.task_id = task_id
+        self.worker = worker
+        self.lease = lease
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.lost = False
+
+    def run(self) -> None:
+        renewed_at = time.time()
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                if self.queue.heartbeat(self.task_id, self.worker, self.lease):
+                    renewed_at = time.time()
+                    continue
+            except sqlite3.Error:
+                # Try again on the next beat, unless the lease has run out meanwhile
+                if time.time() - renewed_at < self.lease:
+                    continue
+            with self.lock:
+                if not self.stopped.is_set():
+                    self.lost = True
+                    self._interrupt_main()
+            return
+
+    @staticmethod
+    def _interrupt_main() -> None:
+        # A real SIGINT also breaks the main thread out of blocking calls
+        # (waiting on a command, reading a socket); interrupt_main only
+        # takes effect once it is back in Python code
+        if hasattr(signal, "pthread_kill"):
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+        else:
+            _thread.interrupt_main()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped.set()
+        self.join()
+
+
+def run_one(queue: TaskQueue, task: Dict[str, Any], worker: str, workspaces: str,
+            lease: float, command_timeout: Optional[int]) -> bool:
+    """Run a claimed task headlessly in its own workspace and store the result.
+
+    Must be called from the main thread, which the heartbeat interrupts
+    when the lease is lost.
+    """
+    # One directory per attempt: an earlier attempt whose lease expired may
+    # still be running in its own directory
+    workspace = os.path.abspath(os.path.join(workspaces, f"task-{task['id']}-{task['attempts']}"))
+    os.makedirs(workspace)
+    log_path = os.path.join(workspace, "taskgpt.log")
+
+    heartbeat = Heartbeat(queue, task["id"], worker, lease)
+    heartbeat.start()
+    cwd = os.getcwd()
+    success = False
+    result: Dict[str, Any] = {"log": log_path}
+    try:
+        try:
+            os.chdir(workspace)
+            with open(log_path, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+                agent = TaskAgent(api_type=task["api"], interactive=False)
+                agent.command_timeout = command_timeout
+                success = agent.run_task(task["description"])
+                result["steps"] = [
+                    {
+                        "description": step["description"],
+                        "command": step["command"],
+                        "success": ok,
+                        "output": (output or "")[-4000:]
+                    }
+                    for step, ok, output in agent.last_results
+                ]
+        finally:
+            heartbeat.stop()
+    except KeyboardInterrupt:
+        if not heartbeat.lost:
+            raise
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        os.chdir(cwd)
+
+    if heartbeat.lost or not queue.complete(task["id"], worker, success, result, workspace):
+        print(f"Lost the lease on task {task['id']}; stopped it and discarded its result.")
+        return False
+    return success
+
+
+def run_worker(queue: TaskQueue, workspaces: str, lease: float = 60, poll_interval: float = 2,
+               once: bool = False, command_timeout: Optional[int] = 600) -> None:
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker} polling {queue.path}")
+    while True:
+        task = queue.claim(worker, lease)
+        if task is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        print(f"Running task {task['id']} (attempt {task['attempts']}/{task['max_attempts']}): {task['description']}")
+        started = time.time()
+        success = run_one(queue, task, worker, workspaces, lease, command_timeout)
+        print(f"Task {task['id']} {'succeeded' if success else 'failed'} in {time.time() - started:.1f}s")
+        if once:
+            return
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="taskgpt", description="taskGPT work queue")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--queue", default=DEFAULT_QUEUE, help=f"Queue database (default: {DEFAULT_QUEUE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", parents=[common], help="Add a task to the queue")
+    submit.add_argument("description", help="Task description")
+    submit.add_argument("--api", default=DEFAULT_API, help=f"API to use (default: {DEFAULT_API})")
+    submit.add_argument("--max-attempts", type=int, default=3, help="Times to run the task before giving up (default: 3)")
+
+    worker = commands.add_parser("worker", parents=[common], help="Claim and run queued tasks")
+    worker.add_argument("--workspaces", help="Directory for task workspaces (default: next to the queue)")
+    worker.add_argument("--lease", type=float, default=60, help="Lease length in seconds (default: 60)")
+    worker.add_argument("--poll", type=float, default=2, help="Seconds between polls of an empty queue (default: 2)")
+    worker.add_argument("--command-timeout", type=int, default=600, help="Seconds allowed per command (default: 600)")
+    worker.add_argument("--once", action="store_true", help="Run at most one task, then exit")
+
+    status = commands.add_parser("status", parents=[common], help="Show queued, running and finished tasks")
+    status.add_argument("task_id", nargs="?", type=int, help="Show the full result of one task")
+
+    args = parser.parse_args(argv)
+    queue = TaskQueue(args.queue)
+
+    if args.command == "submit":
+        task_id = queue.submit(args.description, args.api, args.max_attempts)
+        print(f"Queued task {task_id}")
+    elif args.command == "worker":
+        workspaces = args.workspaces or os.path.join(os.path.dirname(os.path.abspath(args.queue)), "workspaces")
+        try:
+            run_worker(queue, workspaces, args.lease, args.poll, args.once, args.command_timeout)
+        except KeyboardInterrupt:
+            print("\nWorker stopped. Its running task will be re-queued when the lease expires.")
+    elif args.task_id is not None:
+        tasks = queue.tasks(args.task_id)
+        if not tasks:
+            print(f"No task {args.task_id}")
+            return 1
+        task = tasks[0]
+        task["result"] = json.loads(task["result"]) if task["result"] else None
+        print(json.dumps(task, indent=2))
+    else:
+        for task in queue.tasks():
+            print(f"{task['id']:>5}  {task['status']:<8} {task['attempts']}/{task['max_attempts']}  "
+                  f"{task['worker'] or '-':<24} {task['description'][:60]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
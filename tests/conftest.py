@@ -0,0 +1,53 @@
+import json
+
+import pytest
+import requests
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self.body
+
+
+class FakePost:
+    """Stands in for requests.post: records each request and returns scripted replies in order."""
+
+    def __init__(self):
+        self.requests = []
+        self.replies = []
+
+    def __call__(self, url, headers=None, json=None, timeout=None):
+        # A request without a timeout can hang a worker forever
+        assert timeout is not None
+        self.requests.append((url, headers, json))
+        return self.replies.pop(0)
+
+    @property
+    def payloads(self):
+        return [payload for _, _, payload in self.requests]
+
+
+@pytest.fixture
+def fake_post(monkeypatch):
+    post = FakePost()
+    monkeypatch.setattr(requests, "post", post)
+    return post
+
+
+def openai_reply(content, prompt_tokens=0, cached_tokens=0):
+    return FakeResponse(200, {
+        "choices": [{"message": {"content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+    })
+
+
+def gemini_reply(text, prompt_tokens=0, cached_tokens=0):
+    return FakeResponse(200, {
+        "candidates": [{"content": {"parts": [{"text": text}]}}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "cachedContentTokenCount": cached_tokens},
+    })
@@ -0,0 +1,48 @@
+import os
+import stat
+
+from taskgpt.materialize import FILE_MODE, write_files
+
+
+def test_last_write_to_a_path_wins(tmp_path):
+    target = tmp_path / "a.txt"
+    target.write_text("X")
+
+    assert write_files([(str(target), "Y"), (str(target), "X")]) is None
+
+    assert target.read_text() == "X"
+    assert [p.name for p in tmp_path.iterdir()] == ["a.txt"]
+
+
+def test_identical_content_is_not_rewritten(tmp_path):
+    target = tmp_path / "same.txt"
+    target.write_text("content\n")
+    inode = target.stat().st_ino
+
+    assert write_files([(str(target), "content\n")]) is None
+
+    assert target.stat().st_ino == inode
+
+
+def test_batch_creates_directories_with_normal_modes(tmp_path):
+    files = [(str(tmp_path / "src" / "a.c"), "int a;\n"), (str(tmp_path / "src" / "sub" / "b.c"), "int b;\n")]
+
+    assert write_files(files) is None
+
+    for filename, content in files:
+        with open(filename) as f:
+            assert f.read() == content
+        assert stat.S_IMODE(os.stat(filename).st_mode) == FILE_MODE
+
+
+def test_staging_failure_leaves_files_untouched(tmp_path):
+    first = tmp_path / "first.txt"
+    first.write_text("old")
+    blocker = tmp_path / "blocker"
+    blocker.write_text("not a directory")
+
+    failure = write_files([(str(first), "new"), (str(blocker / "nested.txt"), "x")])
+
+    assert failure is not None and failure[0] == str(blocker / "nested.txt")
+    assert first.read_text() == "old"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["blocker", "first.txt"]
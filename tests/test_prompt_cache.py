@@ -0,0 +1,116 @@
+import pytest
+
+from conftest import FakeResponse, gemini_reply, openai_reply
+from taskgpt.agent import TaskAgent, DIAGNOSIS_INSTRUCTIONS, PLAN_INSTRUCTIONS
+from taskgpt.prompt_cache import GeminiPromptCache, LocalPromptCache, MIN_CACHE_TOKENS, CHARS_PER_TOKEN
+
+PLAN_REPLY = '[{"description": "List files", "command": "ls"}]'
+
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch):
+    monkeypatch.setattr("taskgpt.router.TASKGPT_HOME", str(tmp_path))
+    monkeypatch.setenv("TASKGPT_PROMPT_CACHE", "off")
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+
+    def make(api_type):
+        monkeypatch.setenv("GEMINI_API_KEY", "gemini-key")
+        monkeypatch.setenv("OPENAI_API_KEY", "openai-key")
+        agent = TaskAgent(api_type=api_type)
+        if api_type == "gemini":
+            agent.prompt_cache = LocalPromptCache(agent.api_key)
+        return agent
+
+    return make
+
+
+def test_gemini_plan_sends_cached_prefix_and_task_suffix(make_agent, fake_post):
+    agent = make_agent("gemini")
+    fake_post.replies = [gemini_reply(PLAN_REPLY) for _ in range(2)]
+
+    assert agent.generate_plan("first task") == [{"description": "List files", "command": "ls"}]
+    agent.generate_plan("second task")
+
+    first, second = fake_post.payloads
+    # The static instructions live in the cache, not in the request
+    assert "systemInstruction" not in first
+    assert first["cachedContent"] == second["cachedContent"]
+    assert first["contents"] == [{"role": "user", "parts": [{"text": "Task: first task"}]}]
+    assert second["contents"] == [{"role": "user", "parts": [{"text": "Task: second task"}]}]
+    assert agent.prompt_cache.misses == 1
+    assert agent.prompt_cache.hits == 1
+
+
+def test_gemini_cached_tokens_are_accounted(make_agent, fake_post):
+    agent = make_agent("gemini")
+    fake_post.replies = [
+        gemini_reply(PLAN_REPLY, prompt_tokens=700, cached_tokens=0),
+        gemini_reply(PLAN_REPLY, prompt_tokens=710, cached_tokens=650),
+    ]
+
+    agent.generate_plan("task")
+    agent.generate_plan("task")
+
+    assert agent.usage == {"calls": 2, "prompt_tokens": 1410, "cached_tokens": 650}
+
+
+def test_gemini_falls_back_inline_when_cache_is_rejected(make_agent, fake_post):
+    agent = make_agent("gemini")
+    fake_post.replies = [
+        FakeResponse(404, {"error": "cached content not found"}),
+        gemini_reply('{"explanation": "e", "solution": "s", "commands": ["ls"]}'),
+    ]
+
+    diagnosis = agent.diagnose_error("boom", "make", "Build")
+
+    assert diagnosis["commands"] == ["ls"]
+    cached, inline = fake_post.payloads
+    assert "cachedContent" in cached
+    assert inline["systemInstruction"] == {"parts": [{"text": DIAGNOSIS_INSTRUCTIONS}]}
+    assert "cachedContent" not in inline
+    assert agent.prompt_cache.entries == {}
+
+
+def test_openai_sends_instructions_as_system_prefix(make_agent, fake_post):
+    agent = make_agent("openai")
+    fake_post.replies = [openai_reply(PLAN_REPLY, prompt_tokens=1200, cached_tokens=1024)]
+
+    result = agent._complete("plan", agent.plan_instructions, "Task: build it", agent._parse_plan)
+
+    assert result == [{"description": "List files", "command": "ls"}]
+    payload = fake_post.payloads[0]
+    assert payload["messages"] == [
+        {"role": "system", "content": agent.plan_instructions},
+        {"role": "user", "content": "Task: build it"},
+    ]
+    assert agent.usage["cached_tokens"] == 1024
+
+
+def test_short_prefixes_are_not_sent_for_caching(tmp_path, fake_post):
+    cache = GeminiPromptCache("gemini-key", path=str(tmp_path / "prompt_cache.json"))
+
+    # The built-in instructions are all below the minimum cacheable size
+    assert cache.get("gemini-2.0-flash", PLAN_INSTRUCTIONS) is None
+    assert fake_post.requests == []
+
+
+def test_long_prefixes_are_cached_and_reused(tmp_path, fake_post):
+    cache = GeminiPromptCache("gemini-key", path=str(tmp_path / "prompt_cache.json"))
+    instructions = "x" * (MIN_CACHE_TOKENS * CHARS_PER_TOKEN)
+    fake_post.replies = [FakeResponse(200, {"name": "cachedContents/abc"})]
+
+    assert cache.get("gemini-2.0-flash", instructions) == "cachedContents/abc"
+    reloaded = GeminiPromptCache("gemini-key", path=str(tmp_path / "prompt_cache.json"))
+    assert reloaded.get("gemini-2.0-flash", instructions) == "cachedContents/abc"
+    assert len(fake_post.requests) == 1
+
+
+def test_gemini_keeps_the_cache_when_rate_limited(make_agent, fake_post):
+    agent = make_agent("gemini")
+    fake_post.replies = [FakeResponse(429, {"error": "rate limited"})]
+
+    assert agent.generate_plan("task") == []
+
+    # No inline resend: it would double the load and drop a valid cache
+    assert len(fake_post.requests) == 1
+    assert len(agent.prompt_cache.entries) == 1
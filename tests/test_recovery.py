@@ -0,0 +1,135 @@
+import os
+import stat
+import time
+import shutil
+import threading
+
+import pytest
+
+from taskgpt.agent import TaskAgent
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setattr("taskgpt.router.TASKGPT_HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("TASKGPT_PROMPT_CACHE", "off")
+    monkeypatch.setenv("GEMINI_API_KEY", "gemini-key")
+    return TaskAgent(api_type="gemini", interactive=False)
+
+
+def promote(agent, live, clone, saved):
+    """Promote what changed in clone since it was copied from live."""
+    changes = agent._save_changes(agent._snapshot(str(live)), str(clone), str(saved))
+    agent._promote_changes(str(saved), changes, str(live))
+
+
+def test_promotion_applies_permission_only_changes(agent, tmp_path):
+    live = tmp_path / "live"
+    live.mkdir()
+    script = live / "run.sh"
+    script.write_text("#!/bin/sh\necho ok\n")
+    script.chmod(0o644)
+    clone = tmp_path / "clone"
+    agent._clone_workspace(str(live), str(clone))
+
+    (clone / "run.sh").chmod(0o755)
+    clone.chmod(0o700)
+    promote(agent, live, clone, tmp_path / "saved")
+
+    assert stat.S_IMODE(os.stat(script).st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(live).st_mode) == 0o700
+
+
+def test_candidates_are_parsed_from_a_json_array(agent):
+    content = '''```json
+[
+    {"explanation": "e", "solution": "link libm", "commands": ["gcc -o p p.c -lm"]},
+    {"explanation": "e", "solution": "nothing to run", "commands": []},
+    "not an object"
+]
+```'''
+
+    candidates = agent._parse_candidates(content)
+
+    assert [c["commands"] for c in candidates] == [["gcc -o p p.c -lm"]]
+    assert agent._parse_candidates("no json here") is None
+
+
+def test_candidate_writes_outside_the_copy_are_refused(agent, tmp_path):
+    clone = tmp_path / "clone"
+    clone.mkdir()
+    outside = tmp_path / "outside.txt"
+    cancelled = threading.Event()
+
+    for target in (str(outside), "../outside.txt"):
+        passed, detail = agent._run_candidate_commands([f"WRITE_FILE:{target}:x"], str(clone), cancelled)
+        assert not passed
+        assert "outside the workspace" in detail
+    assert not outside.exists()
+
+    passed, _ = agent._run_candidate_commands(["WRITE_FILE:sub/inside.txt:x"], str(clone), cancelled)
+    assert passed
+    assert (clone / "sub" / "inside.txt").read_text() == "x"
+
+
+def test_promotion_applies_deletions_and_symlinks(agent, tmp_path):
+    live = tmp_path / "live"
+    (live / "old_dir").mkdir(parents=True)
+    (live / "old_dir" / "f").write_text("f")
+    (live / "gone.txt").write_text("gone")
+    (live / "keep.txt").write_text("keep")
+    (live / "link").symlink_to("keep.txt")
+    clone = tmp_path / "clone"
+    agent._clone_workspace(str(live), str(clone))
+
+    shutil.rmtree(clone / "old_dir")
+    (clone / "gone.txt").unlink()
+    (clone / "link").unlink()
+    (clone / "link").symlink_to("new/file.txt")
+    (clone / "new").mkdir()
+    (clone / "new" / "file.txt").write_text("new")
+    promote(agent, live, clone, tmp_path / "saved")
+
+    assert sorted(os.listdir(live)) == ["keep.txt", "link", "new"]
+    assert os.readlink(live / "link") == "new/file.txt"
+    assert (live / "link").read_text() == "new"
+    assert (live / "keep.txt").read_text() == "keep"
+
+
+def test_parallel_recovery_promotes_only_the_fix(agent, tmp_path, monkeypatch):
+    live = tmp_path / "live"
+    live.mkdir()
+    (live / "run.sh").write_text("#!/bin/sh\necho ran >> log.txt\n")
+    (live / "run.sh").chmod(0o644)
+    monkeypatch.chdir(live)
+    agent.recovery_candidates = 2
+    monkeypatch.setattr(agent, "diagnose_error_candidates", lambda *args: [
+        {"commands": ["false"]},
+        {"commands": ["chmod +x run.sh"]},
+    ])
+
+    assert agent.attempt_recovery("Permission denied", "./run.sh", "Run the script")
+
+    assert os.access(live / "run.sh", os.X_OK)
+    # The failed step ran only in the copy; execute_plan runs it for real
+    assert not (live / "log.txt").exists()
+    # The candidate copies were made next to the workspace and cleaned up
+    assert not [name for name in os.listdir(tmp_path) if "candidate" in name]
+
+
+def test_first_passing_candidate_cancels_the_others(agent, tmp_path, monkeypatch):
+    live = tmp_path / "live"
+    live.mkdir()
+    monkeypatch.chdir(live)
+    agent.recovery_candidates = 2
+    agent.candidate_timeout = 60
+    monkeypatch.setattr(agent, "diagnose_error_candidates", lambda *args: [
+        {"commands": ["sleep 30"]},
+        {"commands": ["touch fixed"]},
+    ])
+
+    started = time.monotonic()
+    assert agent.attempt_recovery("missing file", "test -f fixed", "Check the file")
+
+    assert time.monotonic() - started < 10
+    assert (live / "fixed").exists()
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+from conftest import FakeResponse, openai_reply
+from taskgpt.agent import TaskAgent
+from taskgpt.router import ModelRouter, OPENAI_BASE_URL
+
+LOCAL_URL = "http://localhost:11434/v1"
+
+
+@pytest.fixture(autouse=True)
+def isolated_home(tmp_path, monkeypatch):
+    monkeypatch.setattr("taskgpt.router.TASKGPT_HOME", str(tmp_path))
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    monkeypatch.delenv("TASKGPT_OPENAI_BASE_URL", raising=False)
+    monkeypatch.delenv("TASKGPT_MODELS", raising=False)
+
+
+def no_prompt(*args):
+    raise AssertionError("the agent should not prompt for a key")
+
+
+def test_local_base_url_does_not_receive_openai_key(monkeypatch, fake_post):
+    monkeypatch.setenv("OPENAI_API_KEY", "real-openai-key")
+    fake_post.replies = [openai_reply('[{"description": "d", "command": "ls"}]')]
+
+    agent = TaskAgent(api_type="openai", base_url=LOCAL_URL, model="llama3.2")
+    agent.generate_plan("task")
+
+    url, headers, _ = fake_post.requests[0]
+    assert url == f"{LOCAL_URL}/chat/completions"
+    assert "Authorization" not in headers
+
+
+def test_keyless_local_endpoint_needs_no_openai_key(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr("builtins.input", no_prompt)
+
+    agent = TaskAgent(api_type="openai", base_url=LOCAL_URL)
+
+    assert agent.api_key is None
+
+
+def test_official_endpoint_still_uses_openai_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "real-openai-key")
+    agent = TaskAgent(api_type="openai")
+
+    route = agent.router.rank("plan")[0]
+    assert route["base_url"] == OPENAI_BASE_URL
+    assert agent._route_api_key(route) == "real-openai-key"
+
+
+def test_local_route_can_opt_into_a_key(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCAL_LLM_KEY", "local-key")
+    config = tmp_path / "models.json"
+    config.write_text(json.dumps({"routes": {"plan": [
+        {"provider": "openai", "model": "m", "base_url": LOCAL_URL, "api_key_env": "LOCAL_LLM_KEY"}
+    ]}}))
+
+    router = ModelRouter("openai", config_path=str(config))
+
+    assert router.routes["plan"][0]["api_key_env"] == "LOCAL_LLM_KEY"
+
+
+def test_model_override_applies_to_every_call_type():
+    router = ModelRouter("openai", base_url=LOCAL_URL, model="llama3.2")
+
+    for routes in router.routes.values():
+        assert [route["model"] for route in routes] == ["llama3.2"]
+
+
+def plan_router(tmp_path, models, **config):
+    path = tmp_path / "models.json"
+    path.write_text(json.dumps({**config, "routes": {"plan": [{"provider": "gemini", "model": m} for m in models]}}))
+    return ModelRouter("gemini", config_path=str(path))
+
+
+def observe(router, model, latency, succeeded=True, parsed=True, times=3):
+    route = next(route for route in router.routes["plan"] if route["model"] == model)
+    for _ in range(times):
+        router.record("plan", route, latency, succeeded, parsed)
+
+
+def ranked(router):
+    return [route["model"] for route in router.rank("plan")]
+
+
+def test_rank_prefers_the_fastest_model(tmp_path):
+    router = plan_router(tmp_path, ["slow", "fast", "medium"])
+    observe(router, "slow", 2.0)
+    observe(router, "fast", 0.5)
+    observe(router, "medium", 1.0)
+
+    assert ranked(router) == ["fast", "medium", "slow"]
+
+
+def test_models_below_the_quality_threshold_go_last(tmp_path):
+    router = plan_router(tmp_path, ["reliable", "unparsable", "flaky"], quality_threshold=0.8)
+    observe(router, "reliable", 2.0)
+    observe(router, "unparsable", 0.1, parsed=False)
+    observe(router, "flaky", 0.2, times=2)
+    observe(router, "flaky", 0.2, succeeded=False, times=1)
+
+    # Unqualified models stay available as fallbacks, most reliable first
+    assert ranked(router) == ["reliable", "flaky", "unparsable"]
+
+
+def test_models_with_few_samples_are_explored_first(tmp_path):
+    router = plan_router(tmp_path, ["known", "new"], min_samples=3)
+    observe(router, "known", 0.1)
+    observe(router, "new", 5.0, times=2)
+
+    assert ranked(router) == ["new", "known"]
+
+
+def test_only_the_last_window_calls_count(tmp_path):
+    router = plan_router(tmp_path, ["recovered", "steady"], window=3)
+    observe(router, "recovered", 0.1, succeeded=False)
+    observe(router, "steady", 1.0)
+    assert ranked(router) == ["steady", "recovered"]
+
+    observe(router, "recovered", 0.1)
+
+    assert ranked(router) == ["recovered", "steady"]
+
+
+def test_old_samples_age_out_so_demoted_models_are_retried(tmp_path):
+    router = plan_router(tmp_path, ["steady", "outage"], max_age=3600)
+    observe(router, "steady", 1.0)
+    observe(router, "outage", 0.1, succeeded=False)
+    assert ranked(router) == ["steady", "outage"]
+
+    for samples in router.stats.values():
+        for sample in samples:
+            sample[0] -= 2 * 3600
+    router._save_stats()
+    observe(router, "steady", 1.0)
+
+    assert ranked(router) == ["outage", "steady"]
+
+
+def test_failed_request_falls_back_to_the_next_model(tmp_path, monkeypatch, fake_post):
+    monkeypatch.setenv("OPENAI_API_KEY", "real-openai-key")
+    config = tmp_path / "models.json"
+    config.write_text(json.dumps({"routes": {"plan": [{"model": "first"}, {"model": "second"}]}}))
+    fake_post.replies = [
+        FakeResponse(500, {"error": "overloaded"}),
+        openai_reply('[{"description": "d", "command": "ls"}]'),
+    ]
+    agent = TaskAgent(api_type="openai", model_config=str(config))
+
+    assert agent.generate_plan("task") == [{"description": "d", "command": "ls"}]
+
+    assert [payload["model"] for payload in fake_post.payloads] == ["first", "second"]
+    first, second = agent.router.routes["plan"]
+    assert agent.router.summary("plan", first)["failure_rate"] == 1.0
+    assert agent.router.summary("plan", second)["quality"] == 1.0
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+import taskgpt.terminal as terminal
+from taskgpt.terminal import Transcript, run_interactive
+
+
+@pytest.fixture(autouse=True)
+def stdin_from_devnull(monkeypatch):
+    with open(os.devnull) as devnull:
+        monkeypatch.setattr(sys, "stdin", devnull)
+        yield
+
+
+@pytest.fixture(params=["pty", "piped"])
+def mode(request, monkeypatch):
+    if request.param == "pty" and terminal.pty is None:
+        pytest.skip("no pty on this platform")
+    if request.param == "piped":
+        monkeypatch.setattr(terminal, "pty", None)
+    return request.param
+
+
+def test_exit_code_and_output_are_returned(mode):
+    returncode, transcript = run_interactive("printf 'x'; exit 3")
+
+    assert returncode == 3
+    assert transcript == "x"
+
+
+def test_escape_sequences_are_stripped(mode):
+    returncode, transcript = run_interactive(r"printf '\033[31mred\033[0m\r\n\033]0;title\007plain\n'")
+
+    assert returncode == 0
+    assert transcript == "red\nplain"
+
+
+def test_transcript_keeps_only_the_most_recent_output(mode):
+    returncode, transcript = run_interactive("i=0; while [ $i -lt 300 ]; do echo line$i; i=$((i+1)); done", limit=64)
+
+    assert returncode == 0
+    lines = transcript.splitlines()
+    assert lines[0] == "[... earlier output truncated ...]"
+    assert lines[-1] == "line299"
+    assert "line0" not in lines
+    assert len(transcript) < 64 + 40
+
+
+def test_transcript_bounds_and_cleans_chunks():
+    transcript = Transcript(limit=8)
+    transcript.add(b"\x1b[1mhello ")
+    transcript.add(b"world\x07")
+
+    assert len(transcript.data) == 8
+    assert transcript.text() == "[... earlier output truncated ...]\no world"
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from taskgpt.worker import TaskQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return TaskQueue(str(tmp_path / "queue.db"))
+
+
+def test_claim_takes_the_oldest_task_and_returns_it_as_claimed(queue):
+    first = queue.submit("first")
+    queue.submit("second")
+
+    task = queue.claim("worker-a", lease=60)
+
+    assert task["id"] == first
+    assert task["status"] == "running"
+    assert task["worker"] == "worker-a"
+    assert task["attempts"] == 1
+    assert task["lease_expires"] > task["started_at"]
+    assert queue.claim("worker-b", lease=60)["description"] == "second"
+    assert queue.claim("worker-c", lease=60) is None
+
+
+def test_expired_lease_is_requeued_for_another_worker(queue):
+    task_id = queue.submit("task")
+    queue.claim("worker-a", lease=-1)
+
+    task = queue.claim("worker-b", lease=60)
+
+    assert task["id"] == task_id
+    assert task["worker"] == "worker-b"
+    assert task["attempts"] == 2
+
+
+def test_task_fails_when_the_final_attempt_expires(queue):
+    task_id = queue.submit("task", max_attempts=1)
+    queue.claim("worker-a", lease=-1)
+
+    assert queue.claim("worker-b", lease=60) is None
+
+    task = queue.tasks(task_id)[0]
+    assert task["status"] == "failed"
+    assert task["worker"] is None
+    assert "lease expired" in json.loads(task["result"])["error"]
+
+
+def test_worker_that_lost_its_lease_cannot_renew_or_complete(queue):
+    task_id = queue.submit("task")
+    queue.claim("worker-a", lease=-1)
+    queue.claim("worker-b", lease=60)
+
+    assert not queue.heartbeat(task_id, "worker-a", lease=60)
+    assert not queue.complete(task_id, "worker-a", True, {"by": "a"}, "/ws-a")
+    assert queue.heartbeat(task_id, "worker-b", lease=60)
+    assert queue.complete(task_id, "worker-b", True, {"by": "b"}, "/ws-b")
+
+    task = queue.tasks(task_id)[0]
+    assert task["status"] == "done"
+    assert json.loads(task["result"]) == {"by": "b"}
+    assert task["workspace"] == "/ws-b"
+    assert not queue.complete(task_id, "worker-b", False, {}, "/ws-b")